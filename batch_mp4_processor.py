@@ -4,17 +4,37 @@
 """
 
 import os
-import glob
 import argparse
 from pathlib import Path
 import time
-from mp4_transcription import MP4TranscriptionApp
+import queue
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import torch
+import torch.multiprocessing
+import whisper
+from mp4_transcription import MP4TranscriptionApp, cuda_device_count
 
 class BatchMP4Processor:
-    def __init__(self, model_size="base", output_dir="transcriptions"):
-        self.app = MP4TranscriptionApp(model_size=model_size, output_dir=output_dir)
+    def __init__(self, model_size="base", output_dir="transcriptions", backend="faster-whisper", batch_size=8,
+                 compile_model=False, cuda_graph=False, onnx_model_dir=None, device=None):
+        # モデルは処理開始時に読み込む（複数GPU時は各ワーカープロセスで読み込む）
+        self.app = None
+        self.app_options = {
+            'model_size': model_size,
+            'output_dir': output_dir,
+            'backend': backend,
+            'batch_size': batch_size,
+            'compile_model': compile_model,
+            'cuda_graph': cuda_graph,
+            'onnx_model_dir': onnx_model_dir,
+            'device': device
+        }
         self.processed_files = []
         self.failed_files = []
+        # Ctrl+Cなどで処理を中断する際に各スレッドへ停止を伝える
+        self._stop_event = threading.Event()
     
     def find_mp4_files(self, directory, recursive=True):
         """
@@ -27,19 +47,78 @@ class BatchMP4Processor:
         Returns:
             list: MP4ファイルのパスリスト
         """
-        if recursive:
-            pattern = os.path.join(directory, "**", "*.mp4")
-            mp4_files = glob.glob(pattern, recursive=True)
-        else:
-            pattern = os.path.join(directory, "*.mp4")
-            mp4_files = glob.glob(pattern)
+        if not os.path.isdir(directory):
+            return []
+        
+        # os.scandirのDirEntryはファイル種別をキャッシュしているため追加のstatが不要
+        mp4_files = []
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                entries = os.scandir(current)
+            except OSError:
+                # globと同様に読めないディレクトリは無視する
+                continue
+            with entries:
+                for entry in entries:
+                    # globと同様に隠しファイル・隠しディレクトリは対象外
+                    if entry.name.startswith("."):
+                        continue
+                    # ディレクトリのシンボリックリンクは循環を避けるため辿らない
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            stack.append(entry.path)
+                    # globと同様に、Windowsでは拡張子の大文字・小文字を区別しない
+                    elif os.path.normcase(entry.name).endswith(".mp4") and entry.is_file():
+                        mp4_files.append(entry.path)
         
         return sorted(mp4_files)
     
+    def _probe_duration(self, mp4_path):
+        """
+        ffprobeでファイルの再生時間を取得（デコードは行わない）
+        
+        Args:
+            mp4_path (str): MP4ファイルのパス
+            
+        Returns:
+            float: 再生時間（秒）。取得できない場合は0
+        """
+        try:
+            output = subprocess.check_output(
+                ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                 "-of", "default=noprint_wrappers=1:nokey=1", str(mp4_path)],
+                stderr=subprocess.DEVNULL
+            )
+            return float(output.strip())
+        except (subprocess.CalledProcessError, ValueError, OSError):
+            # 読めないファイルやffprobeがない場合はそのまま処理に回し、音声抽出時のエラーとして報告する
+            return 0.0
+    
+    def sort_by_duration(self, file_paths):
+        """
+        ファイルを再生時間の短い順に並べ替え
+        
+        Args:
+            file_paths (list): MP4ファイルパスのリスト
+            
+        Returns:
+            list: 再生時間順に並べ替えたファイルパスのリスト
+        """
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            durations = list(executor.map(self._probe_duration, file_paths))
+        
+        return [mp4_path for _, mp4_path in sorted(zip(durations, file_paths), key=lambda item: item[0])]
+    
     def process_files(self, file_paths, language="ja", include_speakers=True, 
-                     include_timestamps=True, keep_audio=False):
+                     include_timestamps=True, keep_audio=False, batch_size=8):
         """
-        複数のMP4ファイルを順次処理
+        複数のMP4ファイルをパイプライン処理
+        
+        音声抽出（CPU）と結果保存（I/O）を別スレッドで、文字起こし（GPU）を
+        呼び出し元のスレッドで並行して実行する。whisperバックエンドでは30秒以内の短いクリップを
+        まとめて1回のデコードで文字起こしし、その際はファイルを再生時間順に処理する
         
         Args:
             file_paths (list): 処理するファイルパスのリスト
@@ -47,44 +126,250 @@ class BatchMP4Processor:
             include_speakers (bool): 話者識別を含めるか
             include_timestamps (bool): タイムスタンプを含めるか
             keep_audio (bool): 抽出した音声ファイルを保持するか
+            batch_size (int): まとめてデコードするファイル数
         """
         total_files = len(file_paths)
+        save_options = {
+            'include_speakers': include_speakers,
+            'include_timestamps': include_timestamps
+        }
         
-        print(f"🎬 {total_files}個のMP4ファイルを処理開始")
+        print(f"🎬 {total_files}個のMP4ファイルを処理開始 (バッチサイズ: {batch_size})")
         print("=" * 60)
         
         start_time = time.time()
         
-        for i, mp4_path in enumerate(file_paths, 1):
-            print(f"\n📹 [{i}/{total_files}] 処理中: {Path(mp4_path).name}")
-            print("-" * 40)
+        num_gpus = cuda_device_count(self.app_options['backend'])
+        multi_gpu = num_gpus > 1 and total_files > 1 and self.app_options['device'] is None
+        
+        # ファイルをまたいだバッチデコードやGPUへの振り分けがある場合のみ、
+        # 長さの近いファイルがまとまるよう再生時間順に並べ替える
+        if multi_gpu or self.app_options['backend'] == "whisper":
+            file_paths = self.sort_by_duration(file_paths)
+        
+        # 複数GPUがあればファイルを振り分けてGPUごとのプロセスで並列処理
+        if multi_gpu:
+            self._process_multi_gpu(file_paths, min(num_gpus, total_files), language,
+                                    save_options, keep_audio, batch_size)
+        else:
+            if self.app is None:
+                self.app = MP4TranscriptionApp(**self.app_options)
+            self._run_pipeline(file_paths, language, save_options, keep_audio, batch_size)
+        
+        total_duration = time.time() - start_time
+        
+        # 処理結果サマリー
+        self.print_summary(total_duration)
+    
+    def _run_pipeline(self, file_paths, language, save_options, keep_audio, batch_size):
+        """音声抽出 -> 文字起こし -> 保存 の各段をキューでつなぎ、別スレッドで実行"""
+        path_q = queue.Queue()
+        decode_q = queue.Queue(maxsize=4)
+        save_q = queue.Queue(maxsize=8)
+        num_decoders = min(4, os.cpu_count() or 1)
+        num_savers = 2
+        
+        # パスは投入時に一度だけPathへ変換し、以降の表示・集計で使い回す（Noneは終了の合図）
+        for mp4_path in file_paths:
+            path_q.put(Path(mp4_path))
+        for _ in range(num_decoders):
+            path_q.put(None)
+        
+        # 中断時に残りのファイルを処理し続けないよう、デーモンスレッドとして実行
+        self._stop_event.clear()
+        threads = [
+            threading.Thread(target=self._decode_worker, args=(path_q, decode_q, keep_audio), daemon=True)
+            for _ in range(num_decoders)
+        ]
+        threads += [
+            threading.Thread(target=self._save_worker, args=(save_q, save_options), daemon=True)
+            for _ in range(num_savers)
+        ]
+        
+        for thread in threads:
+            thread.start()
+        try:
+            # GPUを使う文字起こしは、モデルを読み込んだこのスレッドで直列に実行する
+            # （torch.compileのCUDAグラフの状態はスレッドごとに保持されるため）
+            self._transcribe_worker(decode_q, save_q, num_decoders, num_savers, language, batch_size)
+            for thread in threads:
+                # タイムアウト付きで待ち、Ctrl+Cをすぐに受け取れるようにする
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            print("\n⏹️  処理を中断しています...")
+            self._stop_event.set()
+            raise
+    
+    def _process_multi_gpu(self, file_paths, num_gpus, language, save_options, keep_audio, batch_size):
+        """ファイルをGPU数で分割し、GPUごとのプロセスで処理して結果を集約"""
+        print(f"🖥️  {num_gpus}台のGPUで並列処理します")
+        
+        shards = [file_paths[i::num_gpus] for i in range(num_gpus)]
+        pipeline_options = {
+            'language': language,
+            'save_options': save_options,
+            'keep_audio': keep_audio,
+            'batch_size': batch_size
+        }
+        result_q = torch.multiprocessing.get_context("spawn").Queue()
+        
+        context = torch.multiprocessing.spawn(
+            _gpu_worker,
+            args=(shards, self.app_options, pipeline_options, result_q),
+            nprocs=num_gpus,
+            join=False
+        )
+        
+        # キューが詰まらないよう、プロセスの終了を待つ前に結果を受け取る
+        remaining = set(range(num_gpus))
+        while remaining:
+            try:
+                rank, processed_files, failed_files = result_q.get(timeout=5)
+            except queue.Empty:
+                dead = [rank for rank in remaining if not context.processes[rank].is_alive()]
+                if not dead:
+                    continue
+                
+                # 終了直前に送られた結果がキューに残っている可能性があるため回収してから判定
+                while True:
+                    try:
+                        rank, processed_files, failed_files = result_q.get(timeout=1)
+                    except queue.Empty:
+                        break
+                    remaining.discard(rank)
+                    self.processed_files.extend(processed_files)
+                    self.failed_files.extend(failed_files)
+                
+                # 結果を返さずに終了したワーカーの担当分はすべて失敗とする
+                for rank in dead:
+                    if rank in remaining:
+                        remaining.discard(rank)
+                        self.failed_files.extend(
+                            (Path(mp4_path), f"GPU {rank} のワーカープロセスが異常終了しました")
+                            for mp4_path in shards[rank]
+                        )
+                        print(f"❌ GPU {rank} のワーカープロセスが異常終了しました")
+                continue
             
+            remaining.discard(rank)
+            self.processed_files.extend(processed_files)
+            self.failed_files.extend(failed_files)
+        
+        try:
+            while not context.join():
+                pass
+        except Exception as e:
+            # 異常終了したワーカーの担当分は失敗として集計済み
+            print(f"⚠️  GPUワーカーの終了時にエラー: {e}")
+    
+    def _decode_worker(self, path_q, decode_q, keep_audio):
+        """MP4ファイルから音声を抽出して文字起こしキューへ渡す"""
+        while True:
+            mp4_path = path_q.get()
+            if mp4_path is None or self._stop_event.is_set():
+                break
+            
+            print(f"\n📹 音声抽出中: {mp4_path.name}")
             file_start_time = time.time()
             
             try:
-                output_file = self.app.process_mp4(
-                    mp4_path=mp4_path,
-                    language=language,
-                    include_speakers=include_speakers,
-                    include_timestamps=include_timestamps,
-                    keep_audio=keep_audio
-                )
+                if not os.path.exists(mp4_path):
+                    raise FileNotFoundError(f"MP4ファイルが見つかりません: {mp4_path}")
+                audio_path = self.app.get_audio_path(mp4_path) if keep_audio else None
+                audio_np = self.app.extract_audio_from_mp4(mp4_path, audio_path)
+            except Exception as e:
+                self.failed_files.append((mp4_path, str(e)))
+                print(f"❌ エラー: {mp4_path.name}: {e}")
+                continue
+            
+            decode_q.put((mp4_path, audio_np, file_start_time))
+        
+        decode_q.put(None)
+    
+    def _transcribe_worker(self, decode_q, save_q, num_decoders, num_savers, language, batch_size):
+        """抽出済みの音声を文字起こしして保存キューへ渡す"""
+        pending = []  # バッチデコード待ちの短いクリップ
+        finished = 0
+        
+        try:
+            while finished < num_decoders:
+                # タイムアウト付きで待ち、Ctrl+Cをすぐに受け取れるようにする
+                try:
+                    item = decode_q.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if self._stop_event.is_set():
+                    return
+                if item is None:
+                    finished += 1
+                    continue
                 
-                file_duration = time.time() - file_start_time
+                mp4_path, audio_np, file_start_time = item
+                if self.app.backend == "whisper" and len(audio_np) <= whisper.audio.N_SAMPLES:
+                    pending.append(item)
+                    if len(pending) >= batch_size:
+                        self._transcribe_batch(pending, language, save_q)
+                        pending = []
+                else:
+                    # 30秒を超える音声は通常の文字起こしで処理
+                    self._transcribe_single(mp4_path, audio_np, file_start_time, language, save_q)
+            
+            if pending:
+                self._transcribe_batch(pending, language, save_q)
+        except KeyboardInterrupt:
+            # 保存スレッドは停止を検知して終了するため、終了の合図は送らない
+            self._stop_event.set()
+            raise
+        finally:
+            if not self._stop_event.is_set():
+                for _ in range(num_savers):
+                    save_q.put(None)
+    
+    def _save_worker(self, save_q, save_options):
+        """文字起こし結果をファイルに保存"""
+        while True:
+            item = save_q.get()
+            if item is None or self._stop_event.is_set():
+                break
+            
+            mp4_path, result, file_start_time = item
+            try:
+                output_file = self.app.save_transcript(result, mp4_path, **save_options)
                 self.processed_files.append((mp4_path, output_file))
-                
-                print(f"✅ 完了 ({file_duration:.1f}秒)")
-                
+                print(f"✅ 完了: {mp4_path.name} ({time.time() - file_start_time:.1f}秒)")
             except Exception as e:
-                file_duration = time.time() - file_start_time
                 self.failed_files.append((mp4_path, str(e)))
-                
-                print(f"❌ エラー ({file_duration:.1f}秒): {e}")
+                print(f"❌ エラー: {mp4_path.name}: {e}")
+    
+    def _transcribe_single(self, mp4_path, audio_np, file_start_time, language, save_q):
+        """1ファイルを通常の文字起こしで処理"""
+        print(f"\n📹 文字起こし中: {mp4_path.name}")
         
-        total_duration = time.time() - start_time
+        try:
+            result = self.app.transcribe_with_timestamps(audio_np, language)
+        except Exception as e:
+            self.failed_files.append((mp4_path, str(e)))
+            print(f"❌ エラー ({time.time() - file_start_time:.1f}秒): {e}")
+            return
         
-        # 処理結果サマリー
-        self.print_summary(total_duration)
+        save_q.put((mp4_path, result, file_start_time))
+    
+    def _transcribe_batch(self, batch, language, save_q):
+        """短いクリップをまとめて文字起こし"""
+        print(f"\n📹 バッチ処理中: {', '.join(mp4_path.name for mp4_path, _, _ in batch)}")
+        batch_start_time = time.time()
+        
+        try:
+            results = self.app.transcribe_batch([audio_np for _, audio_np, _ in batch], language)
+        except Exception as e:
+            for mp4_path, _, _ in batch:
+                self.failed_files.append((mp4_path, str(e)))
+            print(f"❌ エラー ({time.time() - batch_start_time:.1f}秒): {e}")
+            return
+        
+        for (mp4_path, _, file_start_time), result in zip(batch, results):
+            save_q.put((mp4_path, result, file_start_time))
     
     def print_summary(self, total_duration):
         """処理結果のサマリーを表示"""
@@ -99,12 +384,12 @@ class BatchMP4Processor:
         if self.processed_files:
             print("\n【成功したファイル】")
             for mp4_path, output_file in self.processed_files:
-                print(f"  📁 {Path(mp4_path).name} -> {Path(output_file).name}")
+                print(f"  📁 {mp4_path.name} -> {os.path.basename(output_file)}")
         
         if self.failed_files:
             print("\n【失敗したファイル】")
             for mp4_path, error in self.failed_files:
-                print(f"  ❌ {Path(mp4_path).name}: {error}")
+                print(f"  ❌ {mp4_path.name}: {error}")
     
     def process_directory(self, directory, **kwargs):
         """
@@ -114,7 +399,7 @@ class BatchMP4Processor:
             directory (str): 処理するディレクトリ
             **kwargs: process_filesに渡すその他の引数
         """
-        mp4_files = self.find_mp4_files(directory, recursive=kwargs.get('recursive', True))
+        mp4_files = self.find_mp4_files(directory, recursive=kwargs.pop('recursive', True))
         
         if not mp4_files:
             print(f"❌ MP4ファイルが見つかりません: {directory}")
@@ -135,6 +420,39 @@ class BatchMP4Processor:
         
         self.process_files(mp4_files, **kwargs)
 
+def _gpu_worker(rank, shards, app_options, pipeline_options, result_q):
+    """
+    1台のGPUを担当するワーカープロセス
+    
+    Args:
+        rank (int): GPU番号
+        shards (list): GPUごとのファイルパスのリスト
+        app_options (dict): MP4TranscriptionAppの初期化引数
+        pipeline_options (dict): BatchMP4Processor._run_pipelineの引数
+        result_q: 処理結果 (rank, processed_files, failed_files) を返すキュー
+    """
+    processed_files = []
+    failed_files = []
+    
+    try:
+        processor = BatchMP4Processor(**dict(app_options, device=f"cuda:{rank}"))
+        processed_files = processor.processed_files
+        failed_files = processor.failed_files
+        
+        # faster-whisperはCPU版のtorchでもGPUを使えるため、torchがCUDAを使える場合のみ設定
+        if torch.cuda.is_available():
+            torch.cuda.set_device(rank)
+        processor.app = MP4TranscriptionApp(**processor.app_options)
+        processor._run_pipeline(shards[rank], **pipeline_options)
+    except Exception as e:
+        # 処理できなかったファイルはすべて失敗として報告する
+        done = {mp4_path for mp4_path, _ in processed_files + failed_files}
+        failed_files.extend(
+            (Path(mp4_path), str(e)) for mp4_path in shards[rank] if Path(mp4_path) not in done
+        )
+    finally:
+        result_q.put((rank, processed_files, failed_files))
+
 def main():
     """メイン関数"""
     parser = argparse.ArgumentParser(description="複数MP4ファイル一括文字起こし")
@@ -148,16 +466,27 @@ def main():
     parser.add_argument("--model", choices=["tiny", "base", "small", "medium", "large"], 
                        default="base", help="Whisperモデルサイズ")
     parser.add_argument("--language", default="ja", help="言語コード")
+    parser.add_argument("--backend", choices=["faster-whisper", "whisper", "onnx"],
+                       default="faster-whisper", help="推論バックエンド")
+    parser.add_argument("--onnx-model-dir", help="ONNXモデルのディレクトリ (onnxバックエンド用)")
+    parser.add_argument("--compile", action="store_true",
+                       help="torch.compileでモデルをコンパイルする (whisperバックエンド・CUDAのみ)")
+    parser.add_argument("--cuda-graph", action="store_true",
+                       help="デコーダをCUDAグラフで実行する (whisperバックエンド・CUDAのみ)")
     parser.add_argument("--output-dir", default="transcriptions", help="出力ディレクトリ")
     parser.add_argument("--no-recursive", action="store_true", help="サブディレクトリを検索しない")
     parser.add_argument("--no-speakers", action="store_true", help="話者識別を無効にする")
     parser.add_argument("--no-timestamps", action="store_true", help="タイムスタンプを無効にする")
     parser.add_argument("--keep-audio", action="store_true", help="抽出した音声ファイルを保持する")
+    parser.add_argument("--batch-size", type=int, default=8, help="まとめて処理するファイル数・VAD区間数 (デフォルト: 8)")
     
     args = parser.parse_args()
     
     # バッチプロセッサ初期化
-    processor = BatchMP4Processor(model_size=args.model, output_dir=args.output_dir)
+    processor = BatchMP4Processor(model_size=args.model, output_dir=args.output_dir,
+                                  backend=args.backend, batch_size=args.batch_size,
+                                  compile_model=args.compile, cuda_graph=args.cuda_graph,
+                                  onnx_model_dir=args.onnx_model_dir)
     
     print("🎬 MP4一括文字起こしアプリ")
     print(f"🧠 使用モデル: {args.model}")
@@ -168,7 +497,8 @@ def main():
         'language': args.language,
         'include_speakers': not args.no_speakers,
         'include_timestamps': not args.no_timestamps,
-        'keep_audio': args.keep_audio
+        'keep_audio': args.keep_audio,
+        'batch_size': args.batch_size
     }
     
     if args.directory:
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+WhisperモデルをONNX形式にエクスポートするスクリプト
+
+エクスポートしたモデルは mp4_transcription.py / batch_mp4_processor.py の
+--backend onnx で使用する。アテンション融合などのグラフ最適化を適用し、
+CPU向けにはINT8の動的量子化、GPU向けにはFP16変換を選択できる
+"""
+
+import os
+import argparse
+from pathlib import Path
+import onnx
+from optimum.onnxruntime import ORTModelForSpeechSeq2Seq, ORTOptimizer, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+from transformers import AutoProcessor
+
+# whisper.load_model と同じモデルを指すHugging FaceのモデルID
+MODEL_IDS = {
+    "tiny": "openai/whisper-tiny",
+    "base": "openai/whisper-base",
+    "small": "openai/whisper-small",
+    "medium": "openai/whisper-medium",
+    "large": "openai/whisper-large-v3",
+}
+
+def finalize_models(output_dir, suffix):
+    """
+    最適化・量子化で付いたファイル名の接尾辞を外し、標準のファイル名で保存し直す
+
+    Args:
+        output_dir (str): モデルのディレクトリ
+        suffix (str): 取り除く接尾辞 (例: _optimized)
+    """
+    for path in Path(output_dir).glob(f"*{suffix}.onnx"):
+        target = path.with_name(path.name.replace(suffix, ""))
+        data_file = target.with_name(f"{target.name}_data")
+        model = onnx.load(str(path))
+        
+        # 外部データは既存ファイルに追記されるため、エクスポート直後や再エクスポート時の
+        # 古いモデル・重みを先に削除しておく
+        for old_file in (target, data_file):
+            if old_file.exists():
+                os.remove(old_file)
+        
+        # 2GBを超えるモデルにも対応できるよう重みは外部ファイルに保存
+        onnx.save_model(model, str(target), save_as_external_data=True,
+                        all_tensors_to_one_file=True, location=data_file.name)
+
+    # 中間ファイルを削除
+    for path in Path(output_dir).glob(f"*{suffix}.onnx*"):
+        os.remove(path)
+
+def export_whisper_onnx(model_size="base", output_dir=None, fp16=False, quantize=False):
+    """
+    WhisperモデルをONNX形式にエクスポート
+
+    Args:
+        model_size (str): Whisperモデルサイズ (tiny, base, small, medium, large)
+        output_dir (str): 出力ディレクトリ
+        fp16 (bool): GPU向けにFP16へ変換するか
+        quantize (bool): CPU向けにINT8の動的量子化を行うか
+
+    Returns:
+        str: 出力ディレクトリのパス
+    """
+    model_id = MODEL_IDS[model_size]
+    output_dir = output_dir or f"whisper-onnx-{model_size}"
+
+    # 1. ONNXへのエクスポート
+    print(f"ONNXへエクスポート中: {model_id} -> {output_dir}")
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(model_id, export=True)
+    model.save_pretrained(output_dir)
+    AutoProcessor.from_pretrained(model_id).save_pretrained(output_dir)
+
+    # 2. グラフ最適化（Q/K/Vの結合やマルチヘッドアテンションの融合）
+    print("グラフを最適化中...")
+    optimization_config = OptimizationConfig(optimization_level=2, optimize_for_gpu=fp16, fp16=fp16)
+    ORTOptimizer.from_pretrained(model).optimize(save_dir=output_dir, optimization_config=optimization_config)
+    suffix = "_optimized"
+
+    # 3. INT8動的量子化（CPU向け）
+    if quantize:
+        print("INT8に量子化中...")
+        quantization_config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        for path in Path(output_dir).glob(f"*{suffix}.onnx"):
+            quantizer = ORTQuantizer.from_pretrained(output_dir, file_name=path.name)
+            quantizer.quantize(save_dir=output_dir, quantization_config=quantization_config)
+        # 量子化前の最適化済みモデルは不要
+        for path in Path(output_dir).glob(f"*{suffix}.onnx*"):
+            os.remove(path)
+        suffix += "_quantized"
+
+    finalize_models(output_dir, suffix)
+
+    print(f"✅ エクスポート完了: {output_dir}")
+    return output_dir
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description="WhisperモデルのONNXエクスポート")
+    parser.add_argument("--model", choices=list(MODEL_IDS), default="base", help="Whisperモデルサイズ")
+    parser.add_argument("--output-dir", help="出力ディレクトリ (デフォルト: whisper-onnx-<model>)")
+
+    # 精度の選択
+    precision_group = parser.add_mutually_exclusive_group()
+    precision_group.add_argument("--fp16", action="store_true", help="GPU向けにFP16へ変換する")
+    precision_group.add_argument("--quantize", action="store_true", help="CPU向けにINT8の動的量子化を行う")
+
+    args = parser.parse_args()
+
+    export_whisper_onnx(
+        model_size=args.model,
+        output_dir=args.output_dir,
+        fp16=args.fp16,
+        quantize=args.quantize
+    )
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,60 @@
 import os
 import sys
 import whisper
-import moviepy.editor as mp
-from datetime import datetime, timedelta
+import ctranslate2
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+import torch
+import subprocess
+import wave
+from datetime import datetime
 import argparse
 import logging
 from pathlib import Path
 import tempfile
 import numpy as np
+from whisper_cuda_graph import install_cuda_graph_decoder
+
+# Whisperの入力と同じサンプリングレート（16kHz）。ffmpegで直接この形式に変換し、
+# Whisper側でのリサンプリングを不要にする
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+
+def cuda_device_count(backend):
+    """
+    バックエンドが利用できるGPUの数を取得
+    
+    faster-whisperはtorchではなくCTranslate2でGPUを使うため、CPU版のtorchが
+    入っている環境でもGPUを使えるようCTranslate2に問い合わせる
+    
+    Args:
+        backend (str): 推論バックエンド (faster-whisper, whisper, onnx)
+        
+    Returns:
+        int: 利用可能なGPUの数
+    """
+    if backend == "faster-whisper":
+        return ctranslate2.get_cuda_device_count()
+    return torch.cuda.device_count()
 
 class MP4TranscriptionApp:
-    def __init__(self, model_size="base", output_dir="transcriptions"):
+    def __init__(self, model_size="base", output_dir="transcriptions", backend="faster-whisper", batch_size=16,
+                 compile_model=False, cuda_graph=False, onnx_model_dir=None, device=None):
         """
         MP4動画ファイルの音声文字起こしアプリ
         
         Args:
             model_size (str): Whisperモデルサイズ (tiny, base, small, medium, large)
             output_dir (str): 出力ファイルを保存するディレクトリ
+            backend (str): 推論バックエンド (faster-whisper, whisper, onnx)
+            batch_size (int): faster-whisperでVAD区間をまとめて推論する数
+            compile_model (bool): torch.compileでモデルをコンパイルするか（whisperバックエンド・CUDAのみ）
+            cuda_graph (bool): デコーダの1ステップをCUDAグラフで実行するか（whisperバックエンド・CUDAのみ）
+            onnx_model_dir (str): export_whisper_onnx.pyで出力したONNXモデルのディレクトリ（onnxバックエンドのみ）
+            device (str): 推論に使うデバイス (cpu, cuda, cuda:1 など)。Noneなら自動選択
         """
         self.output_dir = output_dir
         self.model_size = model_size
+        self.backend = backend
+        self.batch_size = batch_size
         
         # 出力ディレクトリの作成
         os.makedirs(output_dir, exist_ok=True)
@@ -28,53 +63,174 @@ class MP4TranscriptionApp:
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
         
+        # 推論デバイスの決定
+        if device is None:
+            device = "cuda" if cuda_device_count(backend) > 0 else "cpu"
+        device = torch.device(device)
+        use_cuda = device.type == "cuda"
+        
         # Whisperモデルの初期化
-        print(f"Whisperモデル ({model_size}) を読み込んでいます...")
-        self.model = whisper.load_model(model_size)
+        print(f"Whisperモデル ({model_size}, {backend}) を {device} に読み込んでいます...")
+        if backend == "faster-whisper":
+            # CTranslate2のINT8重みで推論（GPUではFP16演算と併用）
+            compute_type = "int8_float16" if use_cuda else "int8"
+            self.model = WhisperModel(model_size, device=device.type, device_index=device.index or 0,
+                                      compute_type=compute_type)
+            # VADで区切った区間をバッチにまとめて1回の推論で処理する
+            self.pipeline = BatchedInferencePipeline(model=self.model)
+        elif backend == "whisper":
+            self.model = whisper.load_model(model_size, device=device)
+            
+            # メルスペクトログラム計算用の窓関数とメルフィルタをモデルと同じデバイスに保持
+            self._window = torch.hann_window(whisper.audio.N_FFT, device=self.model.device)
+            self._mel_filters = whisper.audio.mel_filters(self.model.device, self.model.dims.n_mels)
+            
+            # GPUへの転送用にピン留めしたホストメモリを確保し、非同期転送に使う
+            # （30秒 x バッチサイズ分で固定し、それより長い音声は通常の転送を使う）
+            if use_cuda:
+                self._pinned = torch.empty(max(1, batch_size) * whisper.audio.N_SAMPLES,
+                                           dtype=torch.float32, pin_memory=True)
+                self._h2d_event = torch.cuda.Event()
+            
+            if compile_model:
+                if use_cuda:
+                    self._compile_model()
+                else:
+                    self.logger.warning("CUDAが利用できないためtorch.compileは無効です")
+            
+            if cuda_graph:
+                if use_cuda:
+                    install_cuda_graph_decoder(self.model)
+                else:
+                    self.logger.warning("CUDAが利用できないためCUDAグラフは無効です")
+        elif backend == "onnx":
+            # ONNX Runtimeの融合アテンションカーネルで推論（GPUがなくても高速）
+            import onnxruntime
+            from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+            from transformers import AutoProcessor, pipeline
+            
+            onnx_model_dir = onnx_model_dir or f"whisper-onnx-{model_size}"
+            # CPU版のonnxruntimeにはCUDAExecutionProviderがないため、利用可能な場合のみGPUを使う
+            if use_cuda and "CUDAExecutionProvider" not in onnxruntime.get_available_providers():
+                self.logger.warning("onnxruntimeでCUDAが利用できないためCPUで推論します")
+                use_cuda = False
+            if use_cuda:
+                self.model = ORTModelForSpeechSeq2Seq.from_pretrained(
+                    onnx_model_dir,
+                    provider="CUDAExecutionProvider",
+                    provider_options={"device_id": device.index or 0}
+                )
+            else:
+                self.model = ORTModelForSpeechSeq2Seq.from_pretrained(onnx_model_dir, provider="CPUExecutionProvider")
+            processor = AutoProcessor.from_pretrained(onnx_model_dir)
+            # 30秒ごとの区間をバッチにまとめて推論する
+            self.pipeline = pipeline(
+                "automatic-speech-recognition",
+                model=self.model,
+                tokenizer=processor.tokenizer,
+                feature_extractor=processor.feature_extractor,
+                chunk_length_s=30,
+                batch_size=batch_size
+            )
+        else:
+            raise ValueError(f"未対応のバックエンドです: {backend}")
         print("モデルの読み込み完了")
+        
+        if compile_model and backend != "whisper":
+            self.logger.warning("torch.compileはwhisperバックエンドでのみ有効です")
+        if cuda_graph and backend != "whisper":
+            self.logger.warning("CUDAグラフはwhisperバックエンドでのみ有効です")
+    
+    def _compile_model(self):
+        """
+        エンコーダ・デコーダをtorch.compileでコンパイルし、ダミー入力でウォームアップ
+        
+        エンコーダは入力形状が30秒分で固定のためCUDAグラフ（reduce-overhead）を使う。
+        デコーダはKVキャッシュがステップごとに伸びるためCUDAグラフは使わず、
+        可変長として演算の融合のみを行う（トークンごとの起動オーバーヘッドは --cuda-graph で削減する）。
+        コンパイルには時間がかかるため初回の文字起こしが遅くならないよう、
+        実際と同じ形状で一度推論を実行しておく
+        
+        CUDAグラフの状態はスレッドごとに保持されるため、文字起こしは
+        このメソッドを呼んだスレッド（アプリを生成したスレッド）で行うこと
+        """
+        print("モデルをコンパイルしています...")
+        self.model.encoder = torch.compile(self.model.encoder, mode="reduce-overhead", fullgraph=False)
+        self.model.decoder = torch.compile(self.model.decoder, mode="default", dynamic=True, fullgraph=False)
+        
+        # 通常の文字起こし（1件）とバッチデコード（batch_size件）の形状でウォームアップ
+        options = whisper.DecodingOptions(task="transcribe", without_timestamps=False, fp16=True)
+        for batch in sorted({1, self.batch_size}):
+            mel = self.log_mel_spectrogram(torch.zeros(batch, whisper.audio.N_SAMPLES))
+            self.model.decode(mel, options)
+        print("コンパイル完了")
     
     def extract_audio_from_mp4(self, mp4_path, audio_path=None):
         """
         MP4ファイルから音声を抽出
         
+        ffmpegで16kHzモノラルのfloat32 PCMにデコードし、パイプ経由で
+        NumPy配列として直接受け取る（一時WAVファイルを経由しない）
+        
         Args:
             mp4_path (str): MP4ファイルのパス
-            audio_path (str): 出力する音声ファイルのパス
+            audio_path (str): 音声をWAVファイルとしても保存する場合のパス
             
         Returns:
-            str: 抽出された音声ファイルのパス
+            np.ndarray: 16kHzモノラルの音声波形 (float32)
         """
         try:
-            # 音声ファイルのパスを決定
-            if audio_path is None:
-                base_name = Path(mp4_path).stem
-                audio_path = os.path.join(tempfile.gettempdir(), f"{base_name}_audio.wav")
-            
-            print(f"音声を抽出中: {mp4_path} -> {audio_path}")
-            
-            # MoviePyで音声を抽出
-            video = mp.VideoFileClip(mp4_path)
-            audio = video.audio
-            
-            # WAVファイルとして保存
-            audio.write_audiofile(
-                audio_path,
-                verbose=False,
-                logger=None,  # MoviePyのログを非表示
-                temp_audiofile_path=tempfile.gettempdir()
-            )
+            print(f"音声を抽出中: {mp4_path}")
+            
+            # ffmpegで音声をデコードして標準出力へ書き出す
+            # （映像・字幕・データストリームは選択せず、最初の音声トラックのみ扱う）
+            cmd = [
+                "ffmpeg", "-v", "error",
+                "-i", mp4_path,
+                "-map", "0:a:0",
+                "-vn", "-sn", "-dn",
+                "-f", "f32le",
+                "-acodec", "pcm_f32le",
+                "-ar", str(SAMPLE_RATE),
+                "-ac", "1",
+                "pipe:1"
+            ]
+            try:
+                proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except FileNotFoundError:
+                raise RuntimeError("ffmpegが見つかりません。ffmpegをインストールしてPATHを通してください")
+            if proc.returncode != 0:
+                raise RuntimeError(f"ffmpegによる音声デコードに失敗しました: {proc.stderr.decode(errors='ignore').strip()}")
             
-            # リソースを解放
-            audio.close()
-            video.close()
+            # Whisperが配列を書き換えるためコピーして書き込み可能にする
+            audio_np = np.frombuffer(proc.stdout, dtype=np.float32).copy()
             
-            print(f"音声抽出完了: {audio_path}")
-            return audio_path
+            if audio_path is not None:
+                self.save_audio(audio_np, audio_path)
+            
+            print(f"音声抽出完了: {len(audio_np) / SAMPLE_RATE:.1f}秒")
+            return audio_np
             
         except Exception as e:
             self.logger.error(f"音声抽出エラー: {e}")
             raise
     
+    def save_audio(self, audio_np, audio_path):
+        """
+        音声波形を16bit PCMのWAVファイルとして保存
+        
+        Args:
+            audio_np (np.ndarray): 16kHzモノラルの音声波形 (float32)
+            audio_path (str): 出力する音声ファイルのパス
+        """
+        pcm = (np.clip(audio_np, -1.0, 1.0) * 32767).astype(np.int16)
+        with wave.open(audio_path, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(SAMPLE_RATE)
+            wf.writeframes(pcm.tobytes())
+        print(f"音声ファイルを保存: {audio_path}")
+    
     def format_timestamp(self, seconds):
         """
         秒数を時:分:秒形式に変換
@@ -85,18 +241,61 @@ class MP4TranscriptionApp:
         Returns:
             str: HH:MM:SS形式の時刻
         """
-        td = timedelta(seconds=seconds)
-        total_seconds = int(td.total_seconds())
-        hours, remainder = divmod(total_seconds, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+        t = int(seconds)
+        return f"{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d}"
+    
+    def _to_device(self, audio_np):
+        """
+        音声をピン留めメモリ経由でモデルのデバイスへ非同期転送
+        
+        Args:
+            audio_np (np.ndarray): 音声波形 (float32) [T] または [B, T]
+            
+        Returns:
+            torch.Tensor: モデルのデバイス上の音声波形
+        """
+        if self.model.device.type != "cuda":
+            return torch.from_numpy(audio_np)
+        
+        # バッファに収まらない長い音声はピン留めせずにそのまま転送する
+        if audio_np.size > self._pinned.numel():
+            return torch.from_numpy(audio_np).to(self.model.device)
+        
+        # 前回の転送が終わるまでバッファを書き換えない
+        self._h2d_event.synchronize()
+        pinned = self._pinned[:audio_np.size].view(audio_np.shape)
+        pinned.copy_(torch.from_numpy(audio_np))
+        audio = pinned.to(self.model.device, non_blocking=True)
+        self._h2d_event.record()
+        return audio
+    
+    def log_mel_spectrogram(self, audio):
+        """
+        モデルのデバイス上でlog-メルスペクトログラムを計算
+        
+        Args:
+            audio (torch.Tensor): 音声波形 [T] または [B, T]
+            
+        Returns:
+            torch.Tensor: log-メルスペクトログラム [n_mels, frames] または [B, n_mels, frames]
+        """
+        audio = audio.to(self.model.device, non_blocking=True)
+        stft = torch.stft(audio, whisper.audio.N_FFT, whisper.audio.HOP_LENGTH,
+                          window=self._window, return_complex=True)
+        magnitudes = stft[..., :-1].abs() ** 2
+        
+        mel_spec = self._mel_filters @ magnitudes
+        log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+        # 正規化は音声ごとの最大値を基準に行う
+        log_spec = torch.maximum(log_spec, log_spec.amax(dim=(-2, -1), keepdim=True) - 8.0)
+        return (log_spec + 4.0) / 4.0
     
-    def transcribe_with_timestamps(self, audio_path, language="ja"):
+    def transcribe_with_timestamps(self, audio, language="ja"):
         """
-        音声ファイルをタイムスタンプ付きで文字起こし
+        音声をタイムスタンプ付きで文字起こし
         
         Args:
-            audio_path (str): 音声ファイルのパス
+            audio (np.ndarray | str): 16kHzモノラルの音声波形、または音声ファイルのパス
             language (str): 言語コード (ja, en, etc.)
             
         Returns:
@@ -105,9 +304,21 @@ class MP4TranscriptionApp:
         try:
             print("音声を文字起こし中...")
             
+            if self.backend in ("faster-whisper", "onnx"):
+                if self.backend == "faster-whisper":
+                    result = self._transcribe_faster_whisper(audio, language)
+                else:
+                    result = self._transcribe_onnx(audio, language)
+                print("文字起こし完了")
+                return result
+            
+            # 音声をモデルのデバイスへ転送し、メルスペクトログラムもGPU上で計算させる
+            if isinstance(audio, np.ndarray):
+                audio = self._to_device(audio)
+            
             # Whisperで文字起こし実行
             result = self.model.transcribe(
-                audio_path,
+                audio,
                 language=language,
                 task="transcribe",
                 word_timestamps=True,  # 単語レベルのタイムスタンプ
@@ -121,6 +332,176 @@ class MP4TranscriptionApp:
             self.logger.error(f"文字起こしエラー: {e}")
             raise
     
+    def _transcribe_faster_whisper(self, audio, language):
+        """
+        faster-whisperで文字起こしし、Whisperと同じ形式の結果に変換
+        
+        Args:
+            audio (np.ndarray | str): 16kHzモノラルの音声波形、または音声ファイルのパス
+            language (str): 言語コード
+            
+        Returns:
+            dict: Whisper形式の結果 (text, segments, language)
+        """
+        segments, info = self.pipeline.transcribe(
+            audio,
+            language=language,
+            task="transcribe",
+            word_timestamps=True,  # 単語レベルのタイムスタンプ
+            # バッチ推論では既定でタイムスタンプトークンを出さず、VAD区間（最大30秒）が
+            # 1セグメントになるため、文単位のセグメントに分割させる
+            without_timestamps=False,
+            beam_size=1,
+            vad_filter=True,
+            batch_size=self.batch_size
+        )
+        
+        # セグメントはジェネレータで逐次デコードされるため、進捗として表示しながら集める
+        result_segments = []
+        for segment in segments:
+            print(f"[{self.format_timestamp(segment.start)} --> {self.format_timestamp(segment.end)}] {segment.text.strip()}")
+            result_segments.append({
+                'start': segment.start,
+                'end': segment.end,
+                'text': segment.text,
+            })
+        
+        return {
+            'text': "".join(segment['text'] for segment in result_segments),
+            'segments': result_segments,
+            'language': info.language,
+        }
+    
+    def _transcribe_onnx(self, audio, language):
+        """
+        ONNX Runtimeで文字起こしし、Whisperと同じ形式の結果に変換
+        
+        Args:
+            audio (np.ndarray | str): 16kHzモノラルの音声波形、または音声ファイルのパス
+            language (str): 言語コード
+            
+        Returns:
+            dict: Whisper形式の結果 (text, segments, language)
+        """
+        output = self.pipeline(
+            audio,
+            return_timestamps=True,
+            generate_kwargs={"language": language, "task": "transcribe"}
+        )
+        
+        duration = len(audio) / SAMPLE_RATE if isinstance(audio, np.ndarray) else None
+        segments = []
+        for chunk in output['chunks']:
+            start, end = chunk['timestamp']
+            # 末尾の区間は終了時刻が付かないことがある
+            if end is None:
+                end = duration if duration is not None else start
+            segments.append({
+                'start': start,
+                'end': end,
+                'text': chunk['text'],
+            })
+        
+        return {
+            'text': output['text'],
+            'segments': segments,
+            'language': language,
+        }
+    
+    def transcribe_batch(self, audios, language="ja"):
+        """
+        30秒以内の短い音声をまとめて1回のデコードで文字起こし（whisperバックエンドのみ）
+        
+        Args:
+            audios (list): 16kHzモノラルの音声波形 (np.ndarray) のリスト（各30秒以内）
+            language (str): 言語コード (ja, en, etc.)
+            
+        Returns:
+            list: 各音声に対するWhisper形式の結果 (dict)
+        """
+        try:
+            print(f"{len(audios)}件の音声をまとめて文字起こし中...")
+            
+            # 30秒に揃えた音声を1回で転送し、[B, n_mels, 3000] のメルをデバイス上で一括計算
+            audio_batch = np.stack([whisper.pad_or_trim(audio_np) for audio_np in audios])
+            mel_batch = self.log_mel_spectrogram(self._to_device(audio_batch))
+            
+            options = whisper.DecodingOptions(
+                language=language,
+                task="transcribe",
+                without_timestamps=False,
+                fp16=self.model.device.type == "cuda"
+            )
+            decoded = self.model.decode(mel_batch, options)
+            
+            tokenizer = whisper.tokenizer.get_tokenizer(
+                self.model.is_multilingual,
+                num_languages=self.model.num_languages,
+                language=language,
+                task="transcribe"
+            )
+            
+            results = []
+            for audio_np, res in zip(audios, decoded):
+                duration = len(audio_np) / SAMPLE_RATE
+                results.append({
+                    'text': res.text,
+                    'segments': self._tokens_to_segments(res.tokens, tokenizer, duration),
+                    'language': res.language,
+                })
+            
+            print("文字起こし完了")
+            return results
+            
+        except Exception as e:
+            self.logger.error(f"文字起こしエラー: {e}")
+            raise
+    
+    def _tokens_to_segments(self, tokens, tokenizer, duration):
+        """
+        タイムスタンプトークンを含むトークン列をセグメントに分割
+        
+        Args:
+            tokens (list): デコード結果のトークン列
+            tokenizer: Whisperのトークナイザ
+            duration (float): 音声の長さ（秒）
+            
+        Returns:
+            list: start/end/textを持つセグメント
+        """
+        time_precision = 0.02  # タイムスタンプトークン1つあたりの秒数
+        segments = []
+        start = None
+        text_tokens = []
+        
+        for token in tokens:
+            if token >= tokenizer.timestamp_begin:
+                timestamp = (token - tokenizer.timestamp_begin) * time_precision
+                if start is None:
+                    start = timestamp
+                else:
+                    # <|開始|> テキスト <|終了|> の組でセグメントを確定
+                    if text_tokens:
+                        segments.append({
+                            'start': start,
+                            'end': min(timestamp, duration),
+                            'text': tokenizer.decode(text_tokens),
+                        })
+                    start = None
+                    text_tokens = []
+            elif token < tokenizer.eot:
+                text_tokens.append(token)
+        
+        # 終了タイムスタンプが出力されなかった末尾のテキスト
+        if text_tokens:
+            segments.append({
+                'start': start if start is not None else 0.0,
+                'end': duration,
+                'text': tokenizer.decode(text_tokens),
+            })
+        
+        return segments
+    
     def detect_speakers(self, segments, min_pause=2.0):
         """
         簡易的な話者検出（無音区間で話者変更を推定）
@@ -135,22 +516,20 @@ class MP4TranscriptionApp:
         if not segments:
             return []
         
+        # 前のセグメントとの間隔を一括計算し、長い無音区間ごとに話者番号を進める
+        starts = np.fromiter((s['start'] for s in segments), dtype=np.float64, count=len(segments))
+        ends = np.fromiter((s['end'] for s in segments), dtype=np.float64, count=len(segments))
+        pauses = np.empty_like(starts)
+        pauses[0] = 0.0
+        pauses[1:] = starts[1:] - ends[:-1]
+        speakers = np.cumsum(pauses >= min_pause) + 1
+        # 先頭セグメントは間隔0でも必ず話者1とする
+        speakers -= speakers[0] - 1
+        
         speaker_segments = []
-        current_speaker = 1
-        
-        for i, segment in enumerate(segments):
-            # 前のセグメントとの間隔をチェック
-            if i > 0:
-                prev_end = segments[i-1]['end']
-                current_start = segment['start']
-                pause_duration = current_start - prev_end
-                
-                # 長い無音区間があれば話者変更と推定
-                if pause_duration >= min_pause:
-                    current_speaker += 1
-            
+        for segment, speaker in zip(segments, speakers.tolist()):
             segment_with_speaker = segment.copy()
-            segment_with_speaker['speaker'] = current_speaker
+            segment_with_speaker['speaker'] = speaker
             speaker_segments.append(segment_with_speaker)
         
         return speaker_segments
@@ -174,57 +553,75 @@ class MP4TranscriptionApp:
         output_file = os.path.join(self.output_dir, f"{base_name}_transcript_{timestamp}.txt")
         
         try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                # ヘッダー情報
-                f.write("=" * 60 + "\n")
-                f.write("MP4動画ファイル音声文字起こし結果\n")
-                f.write("=" * 60 + "\n")
-                f.write(f"元ファイル: {mp4_path}\n")
-                f.write(f"処理日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"Whisperモデル: {self.model_size}\n")
-                f.write(f"検出言語: {result.get('language', 'unknown')}\n")
-                f.write("=" * 60 + "\n\n")
-                
-                # セグメント情報を話者検出付きで処理
-                segments = result['segments']
-                if include_speakers:
-                    segments = self.detect_speakers(segments)
-                
-                # 全文を最初に出力
-                f.write("【全文】\n")
-                f.write("-" * 40 + "\n")
-                full_text = result['text'].strip()
-                f.write(full_text + "\n\n")
-                
-                # セグメント別詳細
-                f.write("【詳細（タイムスタンプ付き）】\n")
-                f.write("-" * 40 + "\n")
+            # セグメント情報を話者検出付きで処理
+            segments = result['segments']
+            if include_speakers:
+                segments = self.detect_speakers(segments)
+            full_text = result['text'].strip()
+            
+            # 出力内容をまとめて組み立て、最後に1回で書き込む
+            parts = []
+            
+            # ヘッダー情報
+            parts.append("=" * 60 + "\n")
+            parts.append("MP4動画ファイル音声文字起こし結果\n")
+            parts.append("=" * 60 + "\n")
+            parts.append(f"元ファイル: {mp4_path}\n")
+            parts.append(f"処理日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            parts.append(f"Whisperモデル: {self.model_size}\n")
+            parts.append(f"検出言語: {result.get('language', 'unknown')}\n")
+            parts.append("=" * 60 + "\n\n")
+            
+            # 全文を最初に出力
+            parts.append("【全文】\n")
+            parts.append("-" * 40 + "\n")
+            parts.append(full_text + "\n\n")
+            
+            # セグメント別詳細
+            parts.append("【詳細（タイムスタンプ付き）】\n")
+            parts.append("-" * 40 + "\n")
+            
+            for i, segment in enumerate(segments):
+                start_time = self.format_timestamp(segment['start'])
+                end_time = self.format_timestamp(segment['end'])
+                text = segment['text'].strip()
                 
-                for segment in segments:
-                    start_time = self.format_timestamp(segment['start'])
-                    end_time = self.format_timestamp(segment['end'])
-                    text = segment['text'].strip()
-                    
-                    if include_timestamps and include_speakers:
-                        speaker_info = f"話者{segment.get('speaker', '?')}"
-                        f.write(f"[{start_time} - {end_time}] {speaker_info}: {text}\n")
-                        print(f"[{start_time} - {end_time}] {speaker_info}: {text}")
-                    elif include_timestamps:
-                        f.write(f"[{start_time} - {end_time}] {text}\n")
-                        print(f"[{start_time} - {end_time}] {text}")
-                    else:
-                        f.write(f"{text}\n")
-                        print(text)
+                if include_timestamps and include_speakers:
+                    speaker_info = f"話者{segment.get('speaker', '?')}"
+                    line = f"[{start_time} - {end_time}] {speaker_info}: {text}\n"
+                elif include_timestamps:
+                    line = f"[{start_time} - {end_time}] {text}\n"
+                else:
+                    line = f"{text}\n"
+                parts.append(line)
                 
-                # 統計情報
-                f.write("\n" + "=" * 60 + "\n")
-                f.write("【統計情報】\n")
-                f.write(f"総発話時間: {self.format_timestamp(segments[-1]['end'] if segments else 0)}\n")
-                f.write(f"セグメント数: {len(segments)}\n")
-                if include_speakers:
-                    max_speaker = max([s.get('speaker', 1) for s in segments]) if segments else 1
-                    f.write(f"推定話者数: {max_speaker}\n")
-                f.write(f"総文字数: {len(full_text)}\n")
+                # 進捗表示は一定間隔のセグメントのみ
+                if i % 50 == 0:
+                    sys.stdout.write(line)
+            
+            # 統計情報
+            parts.append("\n" + "=" * 60 + "\n")
+            parts.append("【統計情報】\n")
+            parts.append(f"総発話時間: {self.format_timestamp(segments[-1]['end'] if segments else 0)}\n")
+            parts.append(f"セグメント数: {len(segments)}\n")
+            if include_speakers:
+                max_speaker = max([s.get('speaker', 1) for s in segments]) if segments else 1
+                parts.append(f"推定話者数: {max_speaker}\n")
+            parts.append(f"総文字数: {len(full_text)}\n")
+            
+            # 同名ファイルを並行して保存しても上書きしないよう、排他的に作成し
+            # 既に存在する場合は連番を付けて再試行する
+            counter = 1
+            while True:
+                try:
+                    f = open(output_file, 'x', encoding='utf-8', buffering=1 << 20)
+                    break
+                except FileExistsError:
+                    output_file = os.path.join(self.output_dir, f"{base_name}_transcript_{timestamp}_{counter}.txt")
+                    counter += 1
+            
+            with f:
+                f.write("".join(parts))
                 
             print(f"\n✅ 文字起こし結果を保存しました: {output_file}")
             return output_file
@@ -233,6 +630,19 @@ class MP4TranscriptionApp:
             self.logger.error(f"ファイル保存エラー: {e}")
             raise
     
+    def get_audio_path(self, mp4_path):
+        """
+        抽出した音声を保持する場合の保存先パスを取得
+        
+        Args:
+            mp4_path (str): MP4ファイルのパス
+            
+        Returns:
+            str: WAVファイルのパス
+        """
+        base_name = Path(mp4_path).stem
+        return os.path.join(tempfile.gettempdir(), f"{base_name}_audio.wav")
+    
     def process_mp4(self, mp4_path, language="ja", include_speakers=True, include_timestamps=True, keep_audio=False):
         """
         MP4ファイルを処理してテキストファイルを生成
@@ -250,27 +660,19 @@ class MP4TranscriptionApp:
         if not os.path.exists(mp4_path):
             raise FileNotFoundError(f"MP4ファイルが見つかりません: {mp4_path}")
         
-        audio_path = None
-        try:
-            # 1. 音声抽出
-            audio_path = self.extract_audio_from_mp4(mp4_path)
-            
-            # 2. 文字起こし
-            result = self.transcribe_with_timestamps(audio_path, language)
-            
-            # 3. 結果保存
-            output_file = self.save_transcript(result, mp4_path, include_speakers, include_timestamps)
-            
-            return output_file
-            
-        finally:
-            # 4. 一時音声ファイルのクリーンアップ
-            if audio_path and os.path.exists(audio_path) and not keep_audio:
-                try:
-                    os.remove(audio_path)
-                    print(f"一時音声ファイルを削除: {audio_path}")
-                except Exception as e:
-                    self.logger.warning(f"一時ファイル削除失敗: {e}")
+        # 音声ファイルを保持する場合のみWAVとして書き出す
+        audio_path = self.get_audio_path(mp4_path) if keep_audio else None
+        
+        # 1. 音声抽出
+        audio_np = self.extract_audio_from_mp4(mp4_path, audio_path)
+        
+        # 2. 文字起こし
+        result = self.transcribe_with_timestamps(audio_np, language)
+        
+        # 3. 結果保存
+        output_file = self.save_transcript(result, mp4_path, include_speakers, include_timestamps)
+        
+        return output_file
 
 def main():
     """メイン関数"""
@@ -279,6 +681,16 @@ def main():
     parser.add_argument("--model", choices=["tiny", "base", "small", "medium", "large"], 
                        default="base", help="Whisperモデルサイズ (デフォルト: base)")
     parser.add_argument("--language", default="ja", help="言語コード (デフォルト: ja)")
+    parser.add_argument("--backend", choices=["faster-whisper", "whisper", "onnx"],
+                       default="faster-whisper", help="推論バックエンド (デフォルト: faster-whisper)")
+    parser.add_argument("--onnx-model-dir",
+                       help="ONNXモデルのディレクトリ (onnxバックエンド用, デフォルト: whisper-onnx-<model>)")
+    parser.add_argument("--batch-size", type=int, default=16,
+                       help="faster-whisperでまとめて推論するVAD区間数 (デフォルト: 16)")
+    parser.add_argument("--compile", action="store_true",
+                       help="torch.compileでモデルをコンパイルする (whisperバックエンド・CUDAのみ)")
+    parser.add_argument("--cuda-graph", action="store_true",
+                       help="デコーダをCUDAグラフで実行する (whisperバックエンド・CUDAのみ)")
     parser.add_argument("--output-dir", default="transcriptions", help="出力ディレクトリ")
     parser.add_argument("--no-speakers", action="store_true", help="話者識別を無効にする")
     parser.add_argument("--no-timestamps", action="store_true", help="タイムスタンプを無効にする")
@@ -287,7 +699,10 @@ def main():
     args = parser.parse_args()
     
     # アプリケーション初期化
-    app = MP4TranscriptionApp(model_size=args.model, output_dir=args.output_dir)
+    app = MP4TranscriptionApp(model_size=args.model, output_dir=args.output_dir,
+                              backend=args.backend, batch_size=args.batch_size,
+                              compile_model=args.compile, cuda_graph=args.cuda_graph,
+                              onnx_model_dir=args.onnx_model_dir)
     
     print("🎬 MP4音声文字起こしアプリ")
     print(f"📁 入力ファイル: {args.mp4_file}")
@@ -2,7 +2,8 @@ import pyaudio
 import wave
 import threading
 import time
-import whisper
+import ctranslate2
+from faster_whisper import WhisperModel
 import numpy as np
 from datetime import datetime
 import os
@@ -27,9 +28,19 @@ class TeamsTranscriptionApp:
         self.channels = 1
         self.audio_format = pyaudio.paInt16
         
+        # 文字起こし用バッファ（3秒分を溜めて処理、25%をオーバーラップとして残す）
+        self.buffer_duration = 3.0
+        self._ring_cap = int(self.sample_rate * self.buffer_duration * 1.25)
+        self._ring = np.zeros(self._ring_cap, dtype=np.int16)
+        self._filled = 0
+        self.silence_threshold = 0.005  # 無音と判定するRMSのしきい値
+        
         # Whisperモデルの初期化（小さいモデルで高速化）
         print("Whisperモデルを読み込んでいます...")
-        self.model = whisper.load_model("base")
+        # CPU版のtorchでもGPUを使えるよう、推論を行うCTranslate2に問い合わせる
+        device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+        compute_type = "int8_float16" if device == "cuda" else "int8"
+        self.model = WhisperModel("base", device=device, compute_type=compute_type)
         print("モデルの読み込み完了")
         
         # 出力ディレクトリの作成
@@ -42,6 +53,7 @@ class TeamsTranscriptionApp:
         # 出力ファイルの準備
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         self.output_file = os.path.join(output_dir, f"meeting_transcript_{timestamp}.txt")
+        self._out_fh = None
         
     def list_audio_devices(self):
         """利用可能な音声デバイスを一覧表示"""
@@ -66,18 +78,23 @@ class TeamsTranscriptionApp:
         return (in_data, pyaudio.paContinue)
     
     def transcribe_audio_chunk(self, audio_data):
-        """音声チャンクを文字起こし"""
+        """音声チャンク（int16のnumpy配列）を文字起こし"""
         try:
-            # バイトデータをnumpy配列に変換
-            audio_np = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
+            # float32の[-1, 1]に正規化
+            audio_np = audio_data.astype(np.float32) * (1 / 32768.0)
             
             # 音声の長さが短すぎる場合はスキップ
             if len(audio_np) < self.sample_rate * 0.5:  # 0.5秒未満
                 return None
+            
+            # 無音（RMSがしきい値未満）の場合はWhisperを呼ばずにスキップ
+            rms = np.sqrt(np.mean(audio_np * audio_np, dtype=np.float64))
+            if rms < self.silence_threshold:
+                return None
                 
             # Whisperで文字起こし
-            result = self.model.transcribe(audio_np, language='ja')
-            text = result['text'].strip()
+            segments, _ = self.model.transcribe(audio_np, language='ja', beam_size=1, vad_filter=True)
+            text = "".join(segment.text for segment in segments).strip()
             
             return text if text else None
             
@@ -87,36 +104,39 @@ class TeamsTranscriptionApp:
     
     def transcription_worker(self):
         """文字起こし処理のワーカースレッド"""
-        audio_buffer = b''
-        buffer_duration = 3.0  # 3秒のバッファ
-        buffer_size = int(self.sample_rate * buffer_duration * 2)  # 16bit = 2bytes
+        buffer_size = int(self.sample_rate * self.buffer_duration)  # サンプル数
+        overlap = buffer_size // 4
         
         while self.is_recording or not self.audio_queue.empty():
             try:
                 # キューから音声データを取得
-                if not self.audio_queue.empty():
-                    audio_data = self.audio_queue.get(timeout=1.0)
-                    audio_buffer += audio_data
+                audio_data = self.audio_queue.get(timeout=0.1)
+                samples = np.frombuffer(audio_data, dtype=np.int16)
                 
-                # バッファが十分たまったら文字起こし実行
-                if len(audio_buffer) >= buffer_size:
-                    text = self.transcribe_audio_chunk(audio_buffer)
+                # 事前確保したバッファへ直接書き込む（bytesの連結による再確保を避ける）
+                while len(samples):
+                    n = min(len(samples), self._ring_cap - self._filled)
+                    self._ring[self._filled:self._filled + n] = samples[:n]
+                    self._filled += n
+                    samples = samples[n:]
                     
-                    if text:
-                        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        output_line = f"[{timestamp}] {text}\n"
+                    # バッファが十分たまったら文字起こし実行
+                    if self._filled >= buffer_size:
+                        text = self.transcribe_audio_chunk(self._ring[:self._filled])
                         
-                        # コンソール出力
-                        print(f"🎤 {output_line.strip()}")
+                        if text:
+                            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                            output_line = f"[{timestamp}] {text}\n"
+                            
+                            # コンソール出力
+                            print(f"🎤 {output_line.strip()}")
+                            
+                            # ファイル出力（行バッファリングで改行ごとに書き込まれる）
+                            self._out_fh.write(output_line)
                         
-                        # ファイル出力
-                        with open(self.output_file, 'a', encoding='utf-8') as f:
-                            f.write(output_line)
-                            f.flush()  # リアルタイムでファイルに書き込み
-                    
-                    # バッファをクリア（オーバーラップ用に少し残す）
-                    overlap = buffer_size // 4
-                    audio_buffer = audio_buffer[-overlap:]
+                        # バッファをクリア（オーバーラップ用に少し残す）
+                        self._ring[:overlap] = self._ring[self._filled - overlap:self._filled]
+                        self._filled = overlap
                     
             except queue.Empty:
                 continue
@@ -125,6 +145,7 @@ class TeamsTranscriptionApp:
     
     def start_recording(self, device_index=None):
         """録音開始"""
+        transcription_thread = None
         try:
             p = pyaudio.PyAudio()
             
@@ -135,11 +156,11 @@ class TeamsTranscriptionApp:
             print(f"出力ファイル: {self.output_file}")
             print("録音開始... (Ctrl+Cで停止)")
             
-            # 出力ファイルにヘッダーを書き込み
-            with open(self.output_file, 'w', encoding='utf-8') as f:
-                f.write(f"=== Teams会議 文字起こしログ ===\n")
-                f.write(f"開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write("=" * 50 + "\n\n")
+            # 出力ファイルを録音中ずっと開いたままにし、ヘッダーを書き込み
+            self._out_fh = open(self.output_file, 'w', encoding='utf-8', buffering=1)
+            self._out_fh.write(f"=== Teams会議 文字起こしログ ===\n")
+            self._out_fh.write(f"開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            self._out_fh.write("=" * 50 + "\n\n")
             
             # 録音開始
             self.is_recording = True
@@ -174,18 +195,24 @@ class TeamsTranscriptionApp:
             stream.close()
             p.terminate()
             
-            # ワーカースレッドの終了を待機
-            transcription_thread.join(timeout=10)
+            # 残りの音声の文字起こしが終わるまで待機（途中でファイルを閉じない）
+            transcription_thread.join()
             
             # 終了メッセージをファイルに書き込み
-            with open(self.output_file, 'a', encoding='utf-8') as f:
-                f.write(f"\n終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            self._out_fh.write(f"\n終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             
             print(f"録音完了。ファイルが保存されました: {self.output_file}")
             
         except Exception as e:
             self.logger.error(f"録音エラー: {e}")
             self.is_recording = False
+        finally:
+            # エラー時もワーカーが書き込みを終えてからファイルを閉じる
+            if transcription_thread is not None and transcription_thread.is_alive():
+                transcription_thread.join()
+            if self._out_fh is not None:
+                self._out_fh.close()
+                self._out_fh = None
 
 def main():
     """メイン関数"""
@@ -0,0 +1,211 @@
+"""
+Whisperデコーダの1トークン分の推論をCUDAグラフとして記録・再生するモジュール
+
+openai-whisperのデコーダはトークンごとに数百回のカーネル起動を行うため、
+バッチサイズ1ではGPUの計算よりも起動オーバーヘッドが支配的になる。
+KVキャッシュを固定サイズのバッファに置き換えて形状を一定にし、
+1ステップ分の推論をCUDAグラフとして記録することで、以降はreplay1回で実行する
+"""
+
+import torch
+import torch.nn.functional as F
+from whisper.decoding import DecodingOptions, DecodingTask, Inference
+
+
+class CUDAGraphDecoder:
+    def __init__(self, model):
+        """
+        静的KVキャッシュとCUDAグラフを保持するデコーダ
+
+        Args:
+            model (whisper.model.Whisper): CUDA上のWhisperモデル
+        """
+        self.model = model
+        self.n_ctx = model.dims.n_text_ctx
+        self._arange = torch.arange(self.n_ctx, device=model.device)
+        # (バッチサイズ, dtype, 音声特徴量の長さ) ごとのバッファとグラフ
+        self._states = {}
+
+    def _get_state(self, batch_size, audio_features):
+        """形状に対応する静的バッファを取得（なければ確保）"""
+        key = (batch_size, audio_features.dtype, audio_features.shape[1])
+        if key not in self._states:
+            n_state = self.model.dims.n_text_state
+            n_layer = len(self.model.decoder.blocks)
+
+            def buffers(length):
+                return [
+                    torch.zeros(batch_size, length, n_state, dtype=audio_features.dtype, device=self.model.device)
+                    for _ in range(n_layer)
+                ]
+
+            self._states[key] = {
+                'dtype': audio_features.dtype,
+                'k_self': buffers(self.n_ctx),
+                'v_self': buffers(self.n_ctx),
+                'k_cross': buffers(audio_features.shape[1]),
+                'v_cross': buffers(audio_features.shape[1]),
+                'tokens': torch.zeros(batch_size, 1, dtype=torch.long, device=self.model.device),
+                'positions': torch.zeros(1, dtype=torch.long, device=self.model.device),
+                'graph': None,
+                'logits': None,
+            }
+        return self._states[key]
+
+    @staticmethod
+    def _attention(q, k, v, n_head, mask=None):
+        """マルチヘッドアテンション（maskはTrueの位置のみ参照）"""
+        batch_size, length, n_state = q.shape
+        q = q.view(batch_size, length, n_head, -1).transpose(1, 2)
+        k = k.view(batch_size, k.shape[1], n_head, -1).transpose(1, 2)
+        v = v.view(batch_size, v.shape[1], n_head, -1).transpose(1, 2)
+        out = F.scaled_dot_product_attention(q, k, v, attn_mask=mask)
+        return out.transpose(1, 2).reshape(batch_size, length, n_state)
+
+    def _forward(self, state, tokens, positions):
+        """
+        静的KVキャッシュを使ったデコーダの順伝播
+
+        Args:
+            state (dict): _get_stateで確保したバッファ
+            tokens (torch.Tensor): 入力トークン [B, T]
+            positions (torch.Tensor): 各トークンの位置 [T]
+
+        Returns:
+            torch.Tensor: ロジット [B, T, n_vocab]
+        """
+        decoder = self.model.decoder
+        x = (decoder.token_embedding(tokens) + decoder.positional_embedding[positions]).to(state['dtype'])
+        # 自分より後ろの位置（未書き込みのキャッシュ）は参照しない
+        mask = self._arange[None, :] <= positions[:, None]
+
+        for i, block in enumerate(decoder.blocks):
+            h = block.attn_ln(x)
+            k_cache, v_cache = state['k_self'][i], state['v_self'][i]
+            k_cache.index_copy_(1, positions, block.attn.key(h))
+            v_cache.index_copy_(1, positions, block.attn.value(h))
+            x = x + block.attn.out(self._attention(block.attn.query(h), k_cache, v_cache, block.attn.n_head, mask))
+
+            h = block.cross_attn_ln(x)
+            q = block.cross_attn.query(h)
+            x = x + block.cross_attn.out(
+                self._attention(q, state['k_cross'][i], state['v_cross'][i], block.cross_attn.n_head)
+            )
+
+            x = x + block.mlp(block.mlp_ln(x))
+
+        x = decoder.ln(x)
+        return (x @ decoder.token_embedding.weight.to(x.dtype).T).float()
+
+    def prefill(self, tokens, audio_features):
+        """
+        初期トークン列を通常実行し、KVキャッシュを埋める
+
+        Args:
+            tokens (torch.Tensor): 初期トークン列 [B, T]
+            audio_features (torch.Tensor): エンコーダ出力 [B, n_audio_ctx, n_state]
+
+        Returns:
+            tuple: (state, ロジット [B, T, n_vocab])
+        """
+        state = self._get_state(tokens.shape[0], audio_features)
+        for i, block in enumerate(self.model.decoder.blocks):
+            state['k_cross'][i].copy_(block.cross_attn.key(audio_features))
+            state['v_cross'][i].copy_(block.cross_attn.value(audio_features))
+
+        positions = torch.arange(tokens.shape[1], device=tokens.device)
+        return state, self._forward(state, tokens, positions)
+
+    def step(self, state, tokens):
+        """
+        最後の1トークン分をCUDAグラフのreplayで推論
+
+        Args:
+            state (dict): prefillで返されたバッファ
+            tokens (torch.Tensor): これまでのトークン列 [B, T]
+
+        Returns:
+            torch.Tensor: ロジット [B, 1, n_vocab]
+        """
+        state['tokens'].copy_(tokens[:, -1:])
+        state['positions'].fill_(tokens.shape[-1] - 1)
+
+        if state['graph'] is None:
+            self._capture(state)
+
+        state['graph'].replay()
+        return state['logits'].clone()
+
+    def _capture(self, state):
+        """1ステップ分の推論をCUDAグラフとして記録"""
+        # 記録前に別ストリームでウォームアップする（書き込む値は本番と同じ）
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(3):
+                self._forward(state, state['tokens'], state['positions'])
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            state['logits'] = self._forward(state, state['tokens'], state['positions'])
+        state['graph'] = graph
+
+    def reorder(self, state, source_indices):
+        """ビームサーチの並べ替えに合わせて自己アテンションのKVキャッシュを並べ替え"""
+        index = torch.tensor(source_indices, device=self.model.device)
+        for cache in state['k_self'] + state['v_self']:
+            cache.copy_(cache.index_select(0, index))
+
+
+class CUDAGraphInference(Inference):
+    def __init__(self, graph_decoder, initial_token_length):
+        """
+        DecodingTaskから呼ばれる推論インターフェース
+
+        Args:
+            graph_decoder (CUDAGraphDecoder): 共有するデコーダ
+            initial_token_length (int): 初期トークン列の長さ
+        """
+        self.graph_decoder = graph_decoder
+        self.initial_token_length = initial_token_length
+        self.state = None
+
+    def logits(self, tokens, audio_features):
+        if self.state is None or tokens.shape[-1] <= self.initial_token_length:
+            self.state, logits = self.graph_decoder.prefill(tokens, audio_features)
+            return logits
+        return self.graph_decoder.step(self.state, tokens)
+
+    def rearrange_kv_cache(self, source_indices):
+        if self.state is not None and source_indices != list(range(len(source_indices))):
+            self.graph_decoder.reorder(self.state, source_indices)
+
+    def cleanup_caching(self):
+        self.state = None
+
+
+def install_cuda_graph_decoder(model):
+    """
+    model.decodeをCUDAグラフを使うデコードに置き換える
+
+    whisper.transcribeは内部でmodel.decodeを呼ぶため、文字起こし全体に適用される
+
+    Args:
+        model (whisper.model.Whisper): CUDA上のWhisperモデル
+    """
+    graph_decoder = CUDAGraphDecoder(model)
+
+    @torch.no_grad()
+    def decode(mel, options=DecodingOptions()):
+        single = mel.ndim == 2
+        if single:
+            mel = mel.unsqueeze(0)
+
+        task = DecodingTask(model, options)
+        task.inference = CUDAGraphInference(graph_decoder, len(task.initial_tokens))
+        result = task.run(mel)
+
+        return result[0] if single else result
+
+    model.decode = decode